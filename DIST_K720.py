@@ -27,12 +27,23 @@ except ImportError:
 
 # Importa il modulo RFID solo se disponibile
 try:
-    from rfid import RFIDReader
-    RFID_AVAILABLE = True
+    from rfid import RFIDReader, RFIDScanner, FakeSPIBus, MAX_TEXT_LENGTH, MFRC522_AVAILABLE
+    RFID_MODULE_AVAILABLE = True
+    RFID_AVAILABLE = MFRC522_AVAILABLE
 except ImportError:
+    RFID_MODULE_AVAILABLE = False
     RFID_AVAILABLE = False
     print("AVVISO: Modulo RFID non trovato. Assicurati che 'rfid.py' sia nella stessa directory o che 'mfrc522' sia installato.")
 
+# Lettori RC522 collegati via SPI: bus e chip-select (spidev <bus>.<device>, bus predefinito 0) e pin di reset
+# (numerazione BOARD, None = predefinito). SPI0 ha solo CE0/CE1: un terzo lettore va su SPI1 (dtoverlay=spi1-1cs).
+# Il lettore "distributore" è quello nella posizione interna del K720, usato per la codifica.
+RFID_READERS_CONFIG = [
+    {"name": "DISTRIBUTORE", "bus": 0, "device": 0, "pin_rst": None, "distributore": True},
+    # {"name": "INGRESSO", "bus": 0, "device": 1, "pin_rst": 18},
+    # {"name": "USCITA", "bus": 1, "device": 0, "pin_rst": 16},
+]
+
 
 class SerialCommandSender:
     def __init__(self, com_port, baud_rate=9600, log_callback=None, status_callback=None):
@@ -67,11 +78,40 @@ class SerialCommandSender:
         self.log_callback = log_callback
         self.status_callback = status_callback
 
+        # Ultimo stato riconosciuto dal loop, usato per sincronizzare l'erogazione a lotti
+        self.current_status = None
+        self.status_seq = 0
+        self.status_condition = threading.Condition()
+        self.batch_running = False
+        self.batch_interrotto = False
+
     def log_message(self, message):
         if self.log_callback:
             timestamp = datetime.now().strftime("%H:%M:%S")
             self.log_callback(f"[{timestamp}] {message}")
 
+    def aggiorna_stato(self, status_name):
+        with self.status_condition:
+            self.current_status = status_name
+            self.status_seq += 1
+            self.status_condition.notify_all()
+
+    def attendi_stato(self, stati, timeout, dopo_seq=0, escludi=False):
+        """
+        Attende uno stato ricevuto dopo 'dopo_seq' che sia tra quelli indicati
+        (o diverso da tutti quelli indicati se escludi=True).
+        Ritorna il nome dello stato, oppure None se scade il timeout, il loop si ferma o il lotto viene interrotto.
+        """
+        scadenza = time.monotonic() + timeout
+        with self.status_condition:
+            while True:
+                if self.status_seq > dopo_seq and (self.current_status in stati) != escludi:
+                    return self.current_status
+                rimanente = scadenza - time.monotonic()
+                if rimanente <= 0 or not self.loop_running or self.batch_interrotto:
+                    return None
+                self.status_condition.wait(rimanente)
+
     def format_command(self, command):
         return bytes.fromhex(command)
 
@@ -95,10 +135,11 @@ class SerialCommandSender:
                                 self.log_message(f"Risposta: {response_hex}")
                             
                             # Aggiorniamo lo stato in base alla risposta
-                            if self.status_callback:
-                                # Per ogni risposta conosciuta, verifichiamo se corrisponde
-                                for status_name, signal in self.response_signals.items():
-                                    if response_hex == signal:
+                            # Per ogni risposta conosciuta, verifichiamo se corrisponde
+                            for status_name, signal in self.response_signals.items():
+                                if response_hex == signal:
+                                    self.aggiorna_stato(status_name)
+                                    if self.status_callback:
                                         # Inviamo lo stato e un messaggio appropriato
                                         status_message = ""
                                         if status_name == "CARD_IN_POSITION":
@@ -118,7 +159,7 @@ class SerialCommandSender:
                                             self.log_message(status_message)
                                         
                                         self.status_callback(status_name, True, status_message)
-                                        break
+                                    break
                                 
                             return response_hex
                         else:
@@ -163,6 +204,8 @@ class SerialCommandSender:
 
     def stop_loop(self):
         self.loop_running = False
+        with self.status_condition:
+            self.status_condition.notify_all()
         with self.ser_lock:
             if self.ser and self.ser.is_open:
                 try:
@@ -208,6 +251,293 @@ class SerialCommandSender:
         self.log_message("Accettazione carta...")
         self.send_repeated_command(self.accetta_carta_command, 2)
 
+    def esito_attesa_fallita(self, codice_timeout):
+        # Un'attesa fallita non è un guasto del meccanismo se il lotto è stato interrotto o il loop fermato
+        if self.batch_interrotto:
+            return "INTERROTTO"
+        if not self.loop_running:
+            return "LOOP_FERMO"
+        return codice_timeout
+
+    def prepara_carta(self, timeout=10.0, timeout_ritiro=60.0, timeout_reinvio=3.0):
+        """
+        Porta la carta successiva in posizione interna.
+        Ritorna None se la carta è pronta per l'erogazione, altrimenti il codice dell'errore.
+        """
+        seq = self.status_seq
+        self.send_repeated_command(self.leggi_carta_command, 2)
+        # Finché una carta resta alla bocchetta il lettore riporta CARD_AT_OUTLET:
+        # la carta in posizione diventa visibile solo dopo il ritiro di quella precedente
+        if self.attendi_stato(("CARD_AT_OUTLET",), timeout_ritiro, seq, escludi=True) is None:
+            return self.esito_attesa_fallita("TIMEOUT_RITIRO")
+        if self.attendi_stato(("CARD_IN_POSITION",), timeout_reinvio, seq) is not None:
+            return None
+        if self.batch_interrotto or not self.loop_running:
+            return self.esito_attesa_fallita("TIMEOUT_POSIZIONE")
+
+        # Il comando può essere stato ignorato con la bocchetta occupata: lo ripetiamo una volta
+        self.log_message("Carta non in posizione, ripeto il comando di lettura...")
+        seq = self.status_seq
+        self.send_repeated_command(self.leggi_carta_command, 2)
+        if self.attendi_stato(("CARD_IN_POSITION",), timeout, seq) is None:
+            return self.esito_attesa_fallita("TIMEOUT_POSIZIONE")
+        return None
+
+    def eroga_carte(self, numero, callback_carta=None, timeout=10.0, timeout_ritiro=60.0, lavora_carta=None):
+        """
+        Eroga un lotto di carte in pipeline: mentre una carta attende alla bocchetta
+        la successiva viene già portata in posizione interna, e viene erogata
+        appena la bocchetta si libera.
+        Se indicata, lavora_carta(indice) viene chiamata con la carta in posizione e
+        ritorna un dizionario aggiunto al risultato: con esito diverso da "OK" la carta
+        viene recuperata nel cestino invece che erogata.
+        Ritorna un report con l'esito di ogni carta e la velocità complessiva.
+        """
+        if numero < 1:
+            self.log_message("Numero di carte non valido per il lotto")
+            return None
+        if self.batch_running or not self.loop_running:
+            self.log_message("Impossibile avviare il lotto: loop non attivo o lotto già in corso")
+            return None
+
+        self.batch_running = True
+        self.batch_interrotto = False
+        try:
+            return self.esegui_lotto(numero, callback_carta, timeout, timeout_ritiro, lavora_carta)
+        finally:
+            self.batch_running = False
+
+    def esegui_lotto(self, numero, callback_carta, timeout, timeout_ritiro, lavora_carta):
+        self.log_message(f"Erogazione lotto di {numero} carte...")
+        risultati = []
+        erogate = 0
+        catturate = 0
+        in_posizione = False
+        inizio = time.monotonic()
+
+        for indice in range(1, numero + 1):
+            # Il tempo di ogni carta comprende il posizionamento e il ritiro della precedente
+            inizio_carta = time.monotonic()
+            risultato = {"carta": indice, "esito": "OK"}
+
+            if self.batch_interrotto or not self.loop_running:
+                risultato["esito"] = self.esito_attesa_fallita("INTERROTTO")
+            else:
+                # La carta entra in posizione mentre la precedente attende il ritiro alla bocchetta
+                errore = self.prepara_carta(timeout, timeout_ritiro)
+                # Il comando di lettura è stato inviato: anche se l'attesa fallisce la carta può essere entrata
+                in_posizione = True
+                if errore:
+                    risultato["esito"] = errore
+                else:
+                    if lavora_carta:
+                        risultato.update(lavora_carta(indice) or {})
+
+                    seq = self.status_seq
+                    if self.batch_interrotto or not self.loop_running:
+                        risultato["esito"] = self.esito_attesa_fallita("INTERROTTO")
+                    elif risultato["esito"] == "OK":
+                        self.send_repeated_command(self.invia_carta_command, 2)
+                        # Una carta ritirata subito può non essere mai vista alla bocchetta:
+                        # basta che il lettore torni pronto dopo l'erogazione
+                        if self.attendi_stato(("CARD_AT_OUTLET", "READER_READY"), timeout, seq) is None:
+                            risultato["esito"] = self.esito_attesa_fallita("TIMEOUT_BOCCHETTA")
+                        else:
+                            in_posizione = False
+                    else:
+                        # Carta scartata: la recuperiamo nel cestino e proseguiamo con la successiva
+                        risultato["catturata"] = True
+                        self.send_repeated_command(self.recupera_carta_command, 2)
+                        if self.attendi_stato(("CARD_RETRIEVED",), timeout, seq) is None:
+                            risultato["esito"] = self.esito_attesa_fallita("TIMEOUT_RECUPERO")
+                        else:
+                            in_posizione = False
+
+            risultato["durata"] = round(time.monotonic() - inizio_carta, 2)
+            risultati.append(risultato)
+            if callback_carta:
+                callback_carta(risultato)
+            if risultato.get("catturata") and risultato["esito"] not in ("TIMEOUT_RECUPERO", "INTERROTTO", "LOOP_FERMO"):
+                catturate += 1
+                self.log_message(f"Carta {indice}/{numero} recuperata: {risultato['esito']}")
+            elif risultato["esito"] == "INTERROTTO":
+                self.log_message(f"Lotto interrotto dall'operatore alla carta {indice}")
+                break
+            elif risultato["esito"] == "LOOP_FERMO":
+                self.log_message(f"Lotto interrotto alla carta {indice}: loop fermato")
+                break
+            elif risultato["esito"] != "OK":
+                self.log_message(f"Lotto interrotto alla carta {indice}: {risultato['esito']}")
+                break
+            else:
+                erogate += 1
+                self.log_message(f"Carta {indice}/{numero} erogata ({risultato['durata']} s)")
+
+        # Una carta già portata in posizione ma mai erogata resta nel distributore
+        if in_posizione:
+            self.log_message("Una carta può essere rimasta in posizione interna: usa INVIA CARTA o RECUPERA CARTA")
+
+        durata = time.monotonic() - inizio
+        report = {
+            "richieste": numero,
+            "erogate": erogate,
+            "catturate": catturate,
+            "carta_in_posizione": in_posizione,
+            "risultati": risultati,
+            "durata": round(durata, 2),
+            "carte_al_minuto": round(erogate * 60 / durata, 1) if durata > 0 else 0.0
+        }
+        self.log_message(f"Lotto terminato: {erogate}/{numero} carte in {report['durata']} s "
+                         f"({report['carte_al_minuto']} carte/min)")
+        return report
+
+    def interrompi_lotto(self):
+        if self.batch_running:
+            self.log_message("Interruzione del lotto richiesta...")
+            self.batch_interrotto = True
+            with self.status_condition:
+                self.status_condition.notify_all()
+
+
+class FakeK720Serial:
+    """
+    Porta seriale simulata del K720 per provare la pipeline senza distributore collegato:
+    esegue i comandi ricevuti e risponde all'ENQ con il segnale di stato corrente.
+    ritiro sono i secondi dopo cui la carta viene presa dalla bocchetta (None = mai).
+    """
+    def __init__(self, sender, ritiro=0.5, ignora_erogazione=False, ignora_lettura_bocchetta=False,
+                 on_posizione=None, on_uscita=None):
+        self.sender = sender
+        self.ritiro = ritiro
+        self.ignora_erogazione = ignora_erogazione
+        self.ignora_lettura_bocchetta = ignora_lettura_bocchetta
+        self.on_posizione = on_posizione
+        self.on_uscita = on_uscita
+        self.is_open = True
+        self.in_posizione = False
+        self.alla_bocchetta_da = None
+        self.recuperata = False
+        self.ultimo_comando = None
+
+    def comando(self, command):
+        return self.sender.format_command(command)
+
+    def alla_bocchetta(self):
+        if self.alla_bocchetta_da is None:
+            return False
+        if self.ritiro is not None and time.monotonic() - self.alla_bocchetta_da >= self.ritiro:
+            self.alla_bocchetta_da = None
+            return False
+        return True
+
+    def write(self, data):
+        self.ultimo_comando = data
+        if data == self.comando(self.sender.leggi_carta_command):
+            if not self.in_posizione and not (self.ignora_lettura_bocchetta and self.alla_bocchetta()):
+                self.in_posizione = True
+                if self.on_posizione:
+                    self.on_posizione()
+        elif data == self.comando(self.sender.invia_carta_command):
+            if self.in_posizione and not self.ignora_erogazione:
+                self.in_posizione = False
+                self.alla_bocchetta_da = time.monotonic()
+                if self.on_uscita:
+                    self.on_uscita()
+        elif data == self.comando(self.sender.recupera_carta_command):
+            if self.in_posizione:
+                self.in_posizione = False
+                self.recuperata = True
+                if self.on_uscita:
+                    self.on_uscita()
+
+    def read_all(self):
+        if self.ultimo_comando != self.comando(self.sender.loop_command2):
+            return bytes.fromhex("063030")
+        if self.alla_bocchetta():
+            stato = "CARD_AT_OUTLET"
+        elif self.recuperata:
+            self.recuperata = False
+            stato = "CARD_RETRIEVED"
+        elif self.in_posizione:
+            stato = "CARD_IN_POSITION"
+        else:
+            stato = "READER_READY"
+        return bytes.fromhex(self.sender.response_signals[stato])
+
+    def close(self):
+        self.is_open = False
+
+
+class CodificatoreCarte:
+    """
+    Personalizzazione delle carte: ogni carta viene portata in posizione interna,
+    il lettore RC522 ne legge l'UID, scrive il contenuto e lo verifica rileggendolo.
+    Le carte verificate vengono erogate, quelle non valide recuperate nel cestino.
+    """
+    def __init__(self, serial_sender, rfid_reader, log_callback=None, tentativi=5):
+        self.serial_sender = serial_sender
+        self.rfid_reader = rfid_reader
+        self.log_callback = log_callback
+        self.tentativi = tentativi
+
+    def log_message(self, message):
+        if self.log_callback:
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            self.log_callback(f"[{timestamp}] {message}")
+
+    def riprova(self, operazione, valido=bool):
+        # La carta appena posizionata può non essere ancora nel campo del lettore
+        # e una singola autenticazione può fallire: ritentiamo finché il risultato è valido
+        risultato = None
+        for _ in range(self.tentativi):
+            risultato = operazione()
+            if valido(risultato):
+                return risultato
+            time.sleep(0.1)
+        return None
+
+    @staticmethod
+    def payload_valido(payload):
+        # Un contenuto vuoto non si distingue da una carta non scritta
+        return 0 < len(payload.strip()) and len(payload) <= MAX_TEXT_LENGTH and payload.isascii()
+
+    def codifica_carta(self, payload):
+        uid = self.riprova(self.rfid_reader.read_card)
+        if not uid:
+            return {"esito": "ERRORE_LETTURA"}
+
+        # La scrittura riporta l'UID anche se l'autenticazione fallisce e nulla viene scritto:
+        # scrittura e verifica si ripetono insieme finché la rilettura corrisponde.
+        # Un payload non scrivibile per intero non corrisponde mai e la carta viene scartata
+        atteso = (uid, payload.rstrip())
+        for _ in range(self.tentativi):
+            uid_scritto = self.riprova(lambda: self.rfid_reader.write_card(payload))
+            if uid_scritto != uid:
+                return {"esito": "ERRORE_SCRITTURA", "uid": uid}
+
+            letto = self.riprova(self.rfid_reader.read_card_data, lambda letto: letto[0] == uid and letto[1] is not None)
+            if letto == atteso:
+                self.log_message(f"Carta {uid} codificata e verificata")
+                return {"esito": "OK", "uid": uid}
+
+        return {"esito": "ERRORE_VERIFICA", "uid": uid}
+
+    def codifica_carte(self, payloads, callback_carta=None, timeout=10.0, timeout_ritiro=60.0):
+        """
+        Codifica ed eroga una carta per ogni payload, usando la pipeline di
+        SerialCommandSender.eroga_carte: la carta successiva viene posizionata
+        mentre quella erogata attende il ritiro alla bocchetta. Dopo un recupero
+        nel cestino la carta successiva viene posizionata a recupero concluso.
+        """
+        self.log_message(f"Codifica di {len(payloads)} carte...")
+        return self.serial_sender.eroga_carte(
+            len(payloads),
+            callback_carta=callback_carta,
+            timeout=timeout,
+            timeout_ritiro=timeout_ritiro,
+            lavora_carta=lambda indice: self.codifica_carta(payloads[indice - 1])
+        )
+
 
 class LedIndicator(Canvas):
     def __init__(self, parent, size=30, **kwargs):
@@ -236,11 +566,13 @@ class K720GUI:
         self.available_ports = []
         self.status_leds = {}
         
-        # RFID Reader
+        # Lettori RFID: lo scanner li interroga a turno, rfid_reader è quello del distributore
+        self.rfid_scanner = None
         self.rfid_reader = None
-        self.rfid_thread = None
         self.rfid_running = False
-        self.last_rfid_uid = None
+        
+        # Erogazione a lotti
+        self.batch_thread = None
         
         self.create_widgets()
         self.refresh_ports()
@@ -327,6 +659,20 @@ class K720GUI:
         self.invia_carta_button = tk.Button(commands_frame, text="INVIA CARTA", command=self.invia_carta, bg="#FF9800", fg="white", font=button_font, width=button_width, height=button_height, state=tk.DISABLED)
         self.invia_carta_button.pack(fill=tk.X, padx=20, pady=button_pady)
         
+        # Erogazione a lotti: numero di carte e pulsante di avvio/interruzione
+        batch_frame = tk.Frame(commands_frame, bg="#f0f0f0")
+        batch_frame.pack(fill=tk.X, padx=20, pady=button_pady)
+        
+        tk.Label(batch_frame, text="Carte:", bg="#f0f0f0", font=("Arial", 10)).pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.batch_count_var = tk.StringVar()
+        self.batch_count_var.set("10")
+        self.batch_count_spinbox = tk.Spinbox(batch_frame, from_=1, to=100, width=5, textvariable=self.batch_count_var, font=("Arial", 10))
+        self.batch_count_spinbox.pack(side=tk.LEFT, padx=(0, 10))
+        
+        self.batch_button = tk.Button(batch_frame, text="EROGA LOTTO", command=self.eroga_lotto, bg="#795548", fg="white", font=button_font, height=button_height, state=tk.DISABLED)
+        self.batch_button.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
         self.leggi_carta_button = tk.Button(commands_frame, text="LEGGI CARTA", command=self.leggi_carta, bg="#009688", fg="white", font=button_font, width=button_width, height=button_height, state=tk.DISABLED)
         self.leggi_carta_button.pack(fill=tk.X, padx=20, pady=button_pady)
         
@@ -374,6 +720,19 @@ class K720GUI:
         self.rfid_stop_button = tk.Button(rfid_buttons_frame, text="FERMA LETTURA", command=self.stop_rfid_reading, bg="#FF5722", fg="white", font=("Arial", 10, "bold"), state=tk.DISABLED)
         self.rfid_stop_button.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
+        # Codifica delle carte in posizione interna ({n} = numero progressivo della carta)
+        encode_frame = tk.Frame(rfid_frame, bg="#f0f0f0")
+        encode_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        tk.Label(encode_frame, text="Contenuto:", bg="#f0f0f0", font=("Arial", 10, "bold")).pack(side=tk.LEFT, padx=5)
+        
+        self.payload_var = tk.StringVar()
+        self.payload_var.set("CARTA {n}")
+        tk.Entry(encode_frame, textvariable=self.payload_var, font=("Arial", 10), width=20).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        
+        self.encode_button = tk.Button(encode_frame, text="CODIFICA LOTTO", command=self.codifica_lotto, bg="#8BC34A", fg="white", font=("Arial", 10, "bold"), state=tk.DISABLED)
+        self.encode_button.pack(side=tk.LEFT, padx=(10, 0))
+        
         # Area di log
         log_frame = tk.LabelFrame(right_frame, text="Log delle Operazioni", bg="#f0f0f0", font=("Arial", 12, "bold"))
         log_frame.pack(fill=tk.BOTH, expand=True)
@@ -458,6 +817,7 @@ class K720GUI:
             self.disconnect_button.config(state=tk.DISABLED)
             self.loop_button.config(state=tk.DISABLED)
             self.invia_carta_button.config(state=tk.DISABLED)
+            self.batch_button.config(state=tk.DISABLED)
             self.leggi_carta_button.config(state=tk.DISABLED)
             self.recupera_carta_button.config(state=tk.DISABLED)
             self.accetta_carta_button.config(state=tk.DISABLED)
@@ -504,6 +864,7 @@ class K720GUI:
                 self.loop_button.config(text="FERMA LOOP", bg="#f44336")
                 # Abilitiamo i pulsanti per i comandi
                 self.invia_carta_button.config(state=tk.NORMAL)
+                self.batch_button.config(state=tk.NORMAL)
                 self.leggi_carta_button.config(state=tk.NORMAL)
                 self.recupera_carta_button.config(state=tk.NORMAL)
                 self.accetta_carta_button.config(state=tk.NORMAL)
@@ -512,6 +873,7 @@ class K720GUI:
             self.loop_button.config(text="ATTIVA LOOP", bg="#673AB7")
             # Disabilitiamo i pulsanti per i comandi
             self.invia_carta_button.config(state=tk.DISABLED)
+            self.batch_button.config(state=tk.DISABLED)
             self.leggi_carta_button.config(state=tk.DISABLED)
             self.recupera_carta_button.config(state=tk.DISABLED)
             self.accetta_carta_button.config(state=tk.DISABLED)
@@ -523,6 +885,103 @@ class K720GUI:
         if self.serial_sender and self.serial_sender.loop_running:
             self.serial_sender.invia_carta()
     
+    def eroga_lotto(self):
+        if not self.serial_sender or not self.serial_sender.loop_running:
+            return
+        
+        if self.serial_sender.batch_running:
+            self.serial_sender.interrompi_lotto()
+            return
+        
+        try:
+            numero = int(self.batch_count_var.get())
+        except ValueError:
+            messagebox.showerror("Errore", "Numero di carte non valido")
+            return
+        if numero < 1:
+            messagebox.showerror("Errore", "Numero di carte non valido")
+            return
+        
+        self.batch_button.config(text="INTERROMPI LOTTO", bg="#f44336")
+        self.set_manual_commands_state(tk.DISABLED)
+        self.encode_button.config(state=tk.DISABLED)
+        self.batch_thread = threading.Thread(target=self.batch_loop, args=(self.serial_sender, numero))
+        self.batch_thread.daemon = True
+        self.batch_thread.start()
+    
+    def batch_loop(self, serial_sender, numero):
+        try:
+            serial_sender.eroga_carte(numero, callback_carta=self.batch_progress)
+        except Exception as e:
+            self.log_message(f"Errore durante il lotto: {str(e)}")
+        finally:
+            self.root.after(0, self.batch_finished)
+    
+    def batch_progress(self, risultato):
+        current_status = self.status_var.get().split(" - ")[0]
+        self.status_var.set(f"{current_status} - Lotto: carta {risultato['carta']} {risultato['esito']}")
+    
+    def codifica_lotto(self):
+        if not self.serial_sender or not self.serial_sender.loop_running:
+            self.log_message("Attiva il loop del distributore prima della codifica")
+            return
+        
+        if self.serial_sender.batch_running:
+            self.serial_sender.interrompi_lotto()
+            return
+        
+        try:
+            numero = int(self.batch_count_var.get())
+        except ValueError:
+            messagebox.showerror("Errore", "Numero di carte non valido")
+            return
+        if numero < 1:
+            messagebox.showerror("Errore", "Numero di carte non valido")
+            return
+        
+        payloads = [self.payload_var.get().replace("{n}", str(indice)) for indice in range(1, numero + 1)]
+        if not all(CodificatoreCarte.payload_valido(payload) for payload in payloads):
+            messagebox.showerror("Errore", f"Il contenuto deve essere ASCII e al massimo di {MAX_TEXT_LENGTH} caratteri")
+            return
+        
+        # Il lettore del distributore serve alla codifica: lo escludiamo dal polling,
+        # gli altri lettori continuano a essere letti
+        self.rfid_scanner.pause(self.rfid_reader.name)
+        
+        codificatore = CodificatoreCarte(self.serial_sender, self.rfid_reader, log_callback=self.log_message)
+        
+        self.encode_button.config(text="INTERROMPI", bg="#f44336")
+        self.batch_button.config(state=tk.DISABLED)
+        self.set_manual_commands_state(tk.DISABLED)
+        self.batch_thread = threading.Thread(target=self.encode_loop, args=(codificatore, payloads))
+        self.batch_thread.daemon = True
+        self.batch_thread.start()
+    
+    def encode_loop(self, codificatore, payloads):
+        try:
+            codificatore.codifica_carte(payloads, callback_carta=self.batch_progress)
+        except Exception as e:
+            self.log_message(f"Errore durante la codifica: {str(e)}")
+        finally:
+            self.root.after(0, self.batch_finished)
+    
+    def batch_finished(self):
+        self.batch_button.config(text="EROGA LOTTO", bg="#795548")
+        self.encode_button.config(text="CODIFICA LOTTO", bg="#8BC34A")
+        if self.rfid_reader:
+            self.rfid_scanner.resume(self.rfid_reader.name)
+            self.encode_button.config(state=tk.NORMAL)
+        if self.serial_sender and self.serial_sender.loop_running:
+            self.set_manual_commands_state(tk.NORMAL)
+            self.batch_button.config(state=tk.NORMAL)
+    
+    def set_manual_commands_state(self, state):
+        # Durante un lotto i comandi manuali altererebbero gli stati attesi dalla pipeline
+        self.invia_carta_button.config(state=state)
+        self.leggi_carta_button.config(state=state)
+        self.recupera_carta_button.config(state=state)
+        self.accetta_carta_button.config(state=state)
+    
     def leggi_carta(self):
         if self.serial_sender and self.serial_sender.loop_running:
             self.serial_sender.leggi_carta()
@@ -541,28 +1000,45 @@ class K720GUI:
             self.log_message("Il modulo RFID non è disponibile")
             return
         
-        self.log_message("Inizializzazione del lettore RFID...")
+        self.log_message("Inizializzazione dei lettori RFID...")
         try:
-            self.rfid_reader = RFIDReader()
-            setup_success = self.rfid_reader.setup()
+            self.rfid_scanner = RFIDScanner(uid_callback=self.rfid_card_detected)
+            self.rfid_reader = None
+            for config in RFID_READERS_CONFIG:
+                reader = RFIDReader(name=config["name"], bus=config.get("bus", 0),
+                                    device=config.get("device", 0), pin_rst=config.get("pin_rst"))
+                self.rfid_scanner.add_reader(reader)
+                if config.get("distributore") or self.rfid_reader is None:
+                    self.rfid_reader = reader
+            setup_success = self.rfid_scanner.setup()
             
             if setup_success:
-                self.rfid_status_label.config(text="Lettore RFID inizializzato")
+                self.rfid_status_label.config(text=f"Lettori RFID inizializzati: {len(self.rfid_scanner.readers)}")
                 self.rfid_led.set_status(True, "blue")
                 self.rfid_init_button.config(state=tk.DISABLED)
                 self.rfid_start_button.config(state=tk.NORMAL)
+                self.encode_button.config(state=tk.NORMAL)
                 self.log_message("Lettore RFID inizializzato con successo")
             else:
+                self.release_rfid()
                 self.rfid_status_label.config(text="Errore nell'inizializzazione")
                 self.rfid_led.set_status(False)
                 self.log_message("Errore nell'inizializzazione del lettore RFID")
         except Exception as e:
+            self.release_rfid()
             self.log_message(f"Errore nell'inizializzazione del lettore RFID: {str(e)}")
             self.rfid_status_label.config(text="Errore nell'inizializzazione")
             self.rfid_led.set_status(False)
     
+    def release_rfid(self):
+        # Chiude spidev e GPIO dei lettori già aperti, così una nuova inizializzazione riparte da zero
+        if self.rfid_scanner:
+            self.rfid_scanner.cleanup()
+        self.rfid_scanner = None
+        self.rfid_reader = None
+    
     def start_rfid_reading(self):
-        if not self.rfid_reader:
+        if not self.rfid_scanner:
             self.log_message("Il lettore RFID non è inizializzato")
             return
         
@@ -571,9 +1047,7 @@ class K720GUI:
             return
         
         self.rfid_running = True
-        self.rfid_thread = threading.Thread(target=self.rfid_reading_loop)
-        self.rfid_thread.daemon = True
-        self.rfid_thread.start()
+        self.rfid_scanner.start()
         
         self.rfid_start_button.config(state=tk.DISABLED)
         self.rfid_stop_button.config(state=tk.NORMAL)
@@ -586,32 +1060,25 @@ class K720GUI:
             return
         
         self.rfid_running = False
-        if self.rfid_thread:
-            self.rfid_thread.join(timeout=1.0)
+        self.rfid_scanner.stop()
         
         self.rfid_start_button.config(state=tk.NORMAL)
         self.rfid_stop_button.config(state=tk.DISABLED)
         self.rfid_status_label.config(text="Lettore RFID in standby")
         self.rfid_led.set_status(True, "blue")
         self.log_message("Lettura RFID fermata")
+        
+        for name, reader_stats in self.rfid_scanner.get_stats().items():
+            self.log_message(f"Lettore {name}: {reader_stats['reads']} letture su {reader_stats['polls']} polling "
+                             f"({reader_stats['reads_per_second']} letture/s)")
     
-    def rfid_reading_loop(self):
-        if not self.rfid_reader:
-            return
+    def rfid_card_detected(self, reader_name, uid):
+        self.uid_var.set(f"{uid} ({reader_name})")
+        self.log_message(f"Carta RFID rilevata dal lettore {reader_name} - UID: {uid}")
         
-        while self.rfid_running:
-            uid = self.rfid_reader.read_card()
-            if uid:
-                if uid != self.last_rfid_uid:
-                    self.last_rfid_uid = uid
-                    self.uid_var.set(uid)
-                    self.log_message(f"Carta RFID rilevata - UID: {uid}")
-                    
-                    # Cambia temporaneamente il colore del LED per indicare una lettura riuscita
-                    self.rfid_led.set_status(True, "red")
-                    self.root.after(500, lambda: self.rfid_led.set_status(True, "green"))
-            
-            time.sleep(0.1)  # Piccola pausa per evitare di consumare troppe risorse
+        # Cambia temporaneamente il colore del LED per indicare una lettura riuscita
+        self.rfid_led.set_status(True, "red")
+        self.root.after(500, lambda: self.rfid_led.set_status(True, "green"))
     
     def log_message(self, message):
         self.log_text.insert(tk.END, f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n")
@@ -621,6 +1088,111 @@ class K720GUI:
         self.log_text.delete(1.0, tk.END)
         self.log_message("Log pulito")
 
+def avvia_loop_simulato(**kwargs):
+    sender = SerialCommandSender("SIMULATA")
+    sender.ser = FakeK720Serial(sender, **kwargs)
+    sender.loop_running = True
+    sender.loop_thread = threading.Thread(target=sender.run_loop)
+    sender.loop_thread.daemon = True
+    sender.loop_thread.start()
+    return sender
+
+def test_erogazione():
+    """
+    Funzione di test della pipeline di erogazione con la porta seriale simulata.
+    """
+    def esiti(report):
+        return [risultato["esito"] for risultato in report["risultati"]]
+
+    # Lotto normale: i tempi per carta comprendono posizionamento e ritiro e tornano con la durata totale
+    sender = avvia_loop_simulato(ritiro=0.5)
+    assert sender.eroga_carte(0) is None
+    report = sender.eroga_carte(3, timeout=3, timeout_ritiro=5)
+    sender.stop_loop()
+    assert esiti(report) == ["OK", "OK", "OK"] and report["erogate"] == 3, report
+    assert not report["carta_in_posizione"] and not sender.batch_running
+    durate = sum(risultato["durata"] for risultato in report["risultati"])
+    assert report["durata"] * 0.8 <= durate <= report["durata"] + 0.05, report
+
+    # Carta ritirata prima che il polling la veda alla bocchetta
+    sender = avvia_loop_simulato(ritiro=0)
+    report = sender.eroga_carte(2, timeout=3, timeout_ritiro=5)
+    sender.stop_loop()
+    assert esiti(report) == ["OK", "OK"] and report["erogate"] == 2, report
+
+    # Carta scartata dalla lavorazione: recuperata nel cestino, il lotto prosegue
+    sender = avvia_loop_simulato(ritiro=0.3)
+    report = sender.eroga_carte(3, timeout=3, timeout_ritiro=5,
+                                lavora_carta=lambda indice: {"esito": "SCARTATA"} if indice == 2 else {})
+    sender.stop_loop()
+    assert esiti(report) == ["OK", "SCARTATA", "OK"], report
+    assert report["erogate"] == 2 and report["catturate"] == 1 and report["risultati"][1]["catturata"]
+
+    # Comando di lettura ignorato con la bocchetta occupata: viene ripetuto
+    sender = avvia_loop_simulato(ritiro=0.5, ignora_lettura_bocchetta=True)
+    report = sender.eroga_carte(2, timeout=3, timeout_ritiro=5)
+    sender.stop_loop()
+    assert esiti(report) == ["OK", "OK"], report
+
+    # Erogazione mai completata: timeout alla bocchetta con la carta ancora in posizione
+    sender = avvia_loop_simulato(ignora_erogazione=True)
+    report = sender.eroga_carte(2, timeout=1, timeout_ritiro=5)
+    sender.stop_loop()
+    assert esiti(report) == ["TIMEOUT_BOCCHETTA"] and report["carta_in_posizione"], report
+
+    # Interruzione mentre la prima carta attende il ritiro
+    sender = avvia_loop_simulato(ritiro=None)
+    threading.Timer(1.5, sender.interrompi_lotto).start()
+    report = sender.eroga_carte(3, timeout=3, timeout_ritiro=10)
+    sender.stop_loop()
+    assert esiti(report) == ["OK", "INTERROTTO"] and report["carta_in_posizione"], report
+
+    # Loop fermato durante il lotto
+    sender = avvia_loop_simulato(ritiro=None)
+    threading.Timer(1.5, sender.stop_loop).start()
+    report = sender.eroga_carte(3, timeout=3, timeout_ritiro=10)
+    assert esiti(report) == ["OK", "LOOP_FERMO"], report
+
+    if not RFID_MODULE_AVAILABLE:
+        print("Modulo RFID non trovato: test della codifica saltato")
+    else:
+        test_codifica()
+
+    print("Test dell'erogazione superato")
+
+def test_codifica():
+    """
+    Funzione di test della codifica con il K720 e un lettore RC522 simulati.
+    """
+    spi_bus = FakeSPIBus()
+    reader = RFIDReader(name="DISTRIBUTORE", chip_factory=spi_bus.chip)
+    assert reader.setup()
+
+    # La seconda carta fallisce l'autenticazione alla lettura dell'UID e alla prima scrittura
+    carte = iter([(0xC0DE2001, 0), (0xC0DE2002, 2), (0xC0DE2003, 0)])
+    contenuti_erogati = []
+
+    def carta_in_posizione():
+        card_id, auth_failures = next(carte)
+        spi_bus.present_card(0, 0, card_id, text="OLD", auth_failures=auth_failures)
+
+    def carta_uscita():
+        blocks = spi_bus.card(0, 0)["blocks"]
+        contenuti_erogati.append(bytes(blocks[8] + blocks[9] + blocks[10]).decode("ascii").rstrip())
+        spi_bus.remove_card(0, 0)
+
+    sender = avvia_loop_simulato(ritiro=0.3, on_posizione=carta_in_posizione, on_uscita=carta_uscita)
+    codificatore = CodificatoreCarte(sender, reader)
+    payloads = ["CARTA 1", "CARTA 2", "X" * (MAX_TEXT_LENGTH + 1)]
+    report = codificatore.codifica_carte(payloads, timeout=3, timeout_ritiro=5)
+    sender.stop_loop()
+
+    assert [risultato["esito"] for risultato in report["risultati"]] == ["OK", "OK", "ERRORE_VERIFICA"], report
+    assert report["erogate"] == 2 and report["catturate"] == 1, report
+    assert contenuti_erogati[:2] == ["CARTA 1", "CARTA 2"], contenuti_erogati
+    assert [CodificatoreCarte.payload_valido(payload) for payload in ("CARTA", "   ", "", "città", payloads[2])] == \
+        [True, False, False, False, False]
+
 # Funzione principale
 def main():
     root = tk.Tk()
@@ -630,12 +1202,17 @@ def main():
 
 def on_closing(root, app):
     if app.serial_sender and app.serial_sender.loop_running:
+        app.serial_sender.interrompi_lotto()
         app.serial_sender.stop_loop()
     
     if app.rfid_running:
         app.stop_rfid_reading()
+    app.release_rfid()
     
     root.destroy()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--test" in sys.argv:
+        test_erogazione()
+    else:
+        main()
\ No newline at end of file
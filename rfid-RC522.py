@@ -1,25 +1,227 @@
 # rfid.py
 
-import RPi.GPIO as GPIO
-from mfrc522 import SimpleMFRC522
+import sys
 import time
 import logging
+import threading
 
+# Senza RPi.GPIO / mfrc522 (es. su PC di sviluppo) resta disponibile solo il backend simulato
+try:
+    import RPi.GPIO as GPIO
+    from mfrc522 import MFRC522
+    MFRC522_AVAILABLE = True
+    GPIO.setwarnings(False)
+except (ImportError, RuntimeError):
+    GPIO = None
+    MFRC522_AVAILABLE = False
+
+# Capacità dei blocchi dati usati da MFRC522Reader, come SimpleMFRC522 (settore 2, blocchi 8-10)
+MAX_TEXT_LENGTH = 48
+
+
+def format_uid(id):
+    return format(id, '08X')[:8].upper()
+
+
+class MFRC522Reader:
+    """
+    Lettura e scrittura non bloccanti, con la stessa interfaccia di SimpleMFRC522,
+    su un chip MFRC522 già aperto sul proprio chip-select e reset.
+    """
+    KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+    BLOCK_ADDRS = [8, 9, 10]
+    TRAILER_BLOCK = 11
+
+    def __init__(self, chip):
+        self.READER = chip
+
+    def uid_to_num(self, uid):
+        n = 0
+        for byte in uid[:5]:
+            n = n * 256 + byte
+        return n
+
+    def select_card(self):
+        chip = self.READER
+        status, _ = chip.MFRC522_Request(chip.PICC_REQIDL)
+        if status != chip.MI_OK:
+            return None
+        status, uid = chip.MFRC522_Anticoll()
+        if status != chip.MI_OK:
+            return None
+        chip.MFRC522_SelectTag(uid)
+        return uid
+
+    def read_no_block(self):
+        chip = self.READER
+        uid = self.select_card()
+        if uid is None:
+            return None, None
+        # Con l'autenticazione fallita il testo è None, distinto da una carta vuota
+        text = None
+        if chip.MFRC522_Auth(chip.PICC_AUTHENT1A, self.TRAILER_BLOCK, self.KEY, uid) == chip.MI_OK:
+            data = []
+            for block_addr in self.BLOCK_ADDRS:
+                block = chip.MFRC522_Read(block_addr)
+                if block:
+                    data += block
+            text = "".join(chr(byte) for byte in data)
+        chip.MFRC522_StopCrypto1()
+        return self.uid_to_num(uid), text
+
+    def write_no_block(self, text):
+        chip = self.READER
+        uid = self.select_card()
+        if uid is None:
+            return None, None
+        if chip.MFRC522_Auth(chip.PICC_AUTHENT1A, self.TRAILER_BLOCK, self.KEY, uid) == chip.MI_OK:
+            data = bytearray(text.ljust(MAX_TEXT_LENGTH)[:MAX_TEXT_LENGTH].encode("ascii"))
+            for i, block_addr in enumerate(self.BLOCK_ADDRS):
+                chip.MFRC522_Write(block_addr, list(data[i * 16:(i + 1) * 16]))
+        chip.MFRC522_StopCrypto1()
+        return self.uid_to_num(uid), text[:MAX_TEXT_LENGTH]
+
+
+class FakeSPIBus:
+    """
+    Bus SPI simulato per provare lettori e scanner senza moduli RC522 collegati.
+    chip() si usa come chip_factory di RFIDReader al posto di mfrc522.MFRC522:
+    ogni chip resta legato al proprio bus/chip-select e pin di reset, e le carte
+    appoggiate su un lettore sono visibili solo a quel chip. Come sull'hardware
+    più moduli possono condividere la stessa linea di reset.
+    """
+    # Pin di reset usato da mfrc522.MFRC522 con pin_rst=-1 (numerazione BOARD)
+    DEFAULT_PIN_RST = 22
 
-GPIO.setwarnings(False)
-class RFIDReader:
     def __init__(self):
+        self.chips = {}
+        self.cards = {}
+        self.lock = threading.Lock()
+
+    @property
+    def reset_pins(self):
+        with self.lock:
+            return {chip.pin_rst for chip in self.chips.values()}
+
+    def chip(self, bus=0, device=0, pin_rst=-1, **kwargs):
+        if pin_rst == -1:
+            pin_rst = self.DEFAULT_PIN_RST
+        with self.lock:
+            if (bus, device) in self.chips:
+                raise ValueError(f"Chip-select SPI {bus}.{device} già in uso")
+            chip = FakeMFRC522(self, bus, device, pin_rst)
+            self.chips[(bus, device)] = chip
+            return chip
+
+    def present_card(self, bus, device, card_id, text="", auth_failures=0):
+        uid = list(card_id.to_bytes(4, "big"))
+        uid.append(uid[0] ^ uid[1] ^ uid[2] ^ uid[3])
+        data = list(text.ljust(MAX_TEXT_LENGTH).encode("ascii"))
+        with self.lock:
+            self.cards[(bus, device)] = {
+                "uid": uid,
+                "blocks": {8: data[0:16], 9: data[16:32], 10: data[32:48]},
+                "auth_failures": auth_failures
+            }
+
+    def remove_card(self, bus, device):
+        with self.lock:
+            self.cards.pop((bus, device), None)
+
+    def card(self, bus, device):
+        with self.lock:
+            return self.cards.get((bus, device))
+
+    def release(self, chip):
+        with self.lock:
+            self.chips.pop((chip.bus, chip.device), None)
+
+
+class FakeMFRC522:
+    """Chip MFRC522 simulato su FakeSPIBus, con i metodi usati da MFRC522Reader."""
+    MI_OK = 0
+    MI_NOTAGERR = 1
+    MI_ERR = 2
+    PICC_REQIDL = 0x26
+    PICC_AUTHENT1A = 0x60
+
+    def __init__(self, spi_bus, bus, device, pin_rst):
+        self.spi_bus = spi_bus
+        self.bus = bus
+        self.device = device
+        self.pin_rst = pin_rst
+        self.authenticated = False
+
+    def MFRC522_Request(self, req_mode):
+        card = self.spi_bus.card(self.bus, self.device)
+        return (self.MI_OK, 0x10) if card else (self.MI_NOTAGERR, None)
+
+    def MFRC522_Anticoll(self):
+        card = self.spi_bus.card(self.bus, self.device)
+        return (self.MI_OK, list(card["uid"])) if card else (self.MI_ERR, [])
+
+    def MFRC522_SelectTag(self, uid):
+        return 8
+
+    def MFRC522_Auth(self, auth_mode, block_addr, sector_key, uid):
+        card = self.spi_bus.card(self.bus, self.device)
+        if not card or card["uid"] != list(uid):
+            return self.MI_ERR
+        if card["auth_failures"] > 0:
+            card["auth_failures"] -= 1
+            return self.MI_ERR
+        self.authenticated = True
+        return self.MI_OK
+
+    def MFRC522_Read(self, block_addr):
+        card = self.spi_bus.card(self.bus, self.device)
+        if not card or not self.authenticated:
+            return None
+        return list(card["blocks"].get(block_addr, [0] * 16))
+
+    def MFRC522_Write(self, block_addr, write_data):
+        card = self.spi_bus.card(self.bus, self.device)
+        if card and self.authenticated:
+            card["blocks"][block_addr] = list(write_data)
+
+    def MFRC522_StopCrypto1(self):
+        self.authenticated = False
+
+    def Close(self):
+        self.spi_bus.release(self)
+
+
+class RFIDReader:
+    """
+    Lettore RC522 sul bus SPI. device è il chip-select (spidev <bus>.<device>)
+    e pin_rst il pin di reset in numerazione BOARD (None = pin 22, come SimpleMFRC522).
+    chip_factory(bus, device, pin_rst) crea il chip al posto di mfrc522.MFRC522
+    (es. FakeSPIBus.chip per i test).
+    """
+    def __init__(self, name="RC522", bus=0, device=0, pin_rst=None, chip_factory=None):
+        self.name = name
+        self.bus = bus
+        self.device = device
+        self.pin_rst = pin_rst
+        self.chip_factory = chip_factory
         self.reader = None
 
     def setup(self):
-        logging.info("Inizializzazione del lettore RFID.py 20")
+        logging.info(f"Inizializzazione del lettore RFID {self.name} (SPI {self.bus}.{self.device})")
+        chip_factory = self.chip_factory
+        if chip_factory is None and not MFRC522_AVAILABLE:
+            logging.error("Moduli RPi.GPIO / mfrc522 non disponibili")
+            return False
         try:
-            GPIO.setwarnings(False)
-            self.reader = SimpleMFRC522()
-            logging.info("Lettore RFID inizializzato con successo")
+            if chip_factory is None:
+                GPIO.setwarnings(False)
+                chip_factory = MFRC522
+            self.reader = MFRC522Reader(chip_factory(bus=self.bus, device=self.device,
+                                                     pin_rst=self.pin_rst if self.pin_rst is not None else -1))
+            logging.info(f"Lettore RFID {self.name} inizializzato con successo")
             return True
         except Exception as e:
-            logging.error(f"Errore nell'inizializzazione del lettore RFID: {str(e)}")
+            logging.error(f"Errore nell'inizializzazione del lettore RFID {self.name}: {str(e)}")
             return False
 
     def read_card(self):
@@ -30,7 +232,7 @@ class RFIDReader:
         try:
             id, text = self.reader.read_no_block()
             if id:
-                uid = format(id, '08X')[:8].upper()
+                uid = format_uid(id)
                 logging.info(f"Carta letta con successo. UID: {uid}")
                 return uid
             # Rimuovi completamente il log "Nessuna carta rilevata"
@@ -39,6 +241,165 @@ class RFIDReader:
         except Exception as e:
             logging.error(f"Errore nella lettura della carta RFID: {str(e)}")
         return None
+
+    def read_card_data(self):
+        """
+        Legge UID e testo memorizzato nella carta presente.
+        Ritorna (uid, testo) oppure (None, None) se nessuna carta è stata letta;
+        il testo è None se la carta è stata rilevata ma non autenticata.
+        """
+        if not self.reader:
+            logging.error("Lettore RFID non inizializzato")
+            return None, None
+
+        try:
+            id, text = self.reader.read_no_block()
+            if id:
+                return format_uid(id), text.rstrip() if text is not None else None
+        except Exception as e:
+            logging.error(f"Errore nella lettura dei dati della carta RFID: {str(e)}")
+        return None, None
+
+    def write_card(self, text):
+        """
+        Scrive il testo (max MAX_TEXT_LENGTH caratteri ASCII) nei blocchi dati della carta presente.
+        Ritorna l'UID della carta su cui è stata tentata la scrittura, oppure None.
+        La scrittura va sempre verificata rileggendo la carta con read_card_data.
+        """
+        if not self.reader:
+            logging.error("Lettore RFID non inizializzato")
+            return None
+
+        try:
+            id, _ = self.reader.write_no_block(text[:MAX_TEXT_LENGTH])
+            if id:
+                uid = format_uid(id)
+                logging.info(f"Scrittura eseguita sulla carta. UID: {uid}")
+                return uid
+        except Exception as e:
+            logging.error(f"Errore nella scrittura della carta RFID: {str(e)}")
+        return None
+
+    def cleanup(self):
+        if self.reader is None:
+            return
+        chip = getattr(self.reader, "READER", None)
+        if chip is not None and hasattr(chip, "Close"):
+            chip.Close()
+        if self.chip_factory is None and GPIO is not None:
+            GPIO.cleanup()
+        self.reader = None
+
+
+class RFIDScanner:
+    """
+    Gestisce più lettori RC522 sullo stesso bus SPI interrogandoli a turno da un
+    unico thread, così le transazioni dei lettori in scansione non si sovrappongono.
+    Un lettore messo in pausa può essere usato da un altro thread (es. la codifica):
+    le sue transazioni si alternano a quelle degli altri chip-select, che il driver
+    spidev serializza trasferimento per trasferimento. Ogni UID viene notificato
+    con il nome del lettore che l'ha rilevato.
+    """
+    def __init__(self, uid_callback=None, interval=0.02, miss_limit=3):
+        self.readers = []
+        self.uid_callback = uid_callback
+        self.interval = interval
+        # Polling a vuoto consecutivi dopo i quali la carta si considera allontanata
+        self.miss_limit = miss_limit
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.scan_thread = None
+        self.running = False
+        self.started_at = None
+        # Lettori esclusi dal polling (es. il lettore del distributore durante la codifica)
+        self.paused = set()
+        self.poll_lock = threading.Lock()
+
+    def add_reader(self, reader):
+        self.readers.append(reader)
+        self.stats[reader.name] = {"polls": 0, "reads": 0, "misses": 0, "last_uid": None}
+
+    def get_reader(self, name):
+        for reader in self.readers:
+            if reader.name == name:
+                return reader
+        return None
+
+    def setup(self):
+        """Inizializza tutti i lettori. Ritorna True se sono stati inizializzati tutti."""
+        return all([reader.setup() for reader in self.readers])
+
+    def start(self):
+        if self.running:
+            return
+        with self.stats_lock:
+            for reader_stats in self.stats.values():
+                reader_stats.update(polls=0, reads=0, misses=0, last_uid=None)
+        self.started_at = time.monotonic()
+        self.running = True
+        self.scan_thread = threading.Thread(target=self.scan_loop)
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.scan_thread:
+            self.scan_thread.join(timeout=1.0)
+
+    def pause(self, name):
+        """Esclude un lettore dal polling; al ritorno nessuna lettura su quel lettore è in corso."""
+        self.paused.add(name)
+        with self.poll_lock:
+            pass
+
+    def resume(self, name):
+        self.paused.discard(name)
+
+    def scan_loop(self):
+        while self.running:
+            for reader in self.readers:
+                if not self.running:
+                    break
+                with self.poll_lock:
+                    if not reader.reader or reader.name in self.paused:
+                        continue
+                    uid = reader.read_card()
+                with self.stats_lock:
+                    reader_stats = self.stats[reader.name]
+                    reader_stats["polls"] += 1
+                    new_uid = uid is not None and uid != reader_stats["last_uid"]
+                    if uid:
+                        reader_stats["reads"] += 1
+                        reader_stats["misses"] = 0
+                        reader_stats["last_uid"] = uid
+                    else:
+                        reader_stats["misses"] += 1
+                        if reader_stats["misses"] >= self.miss_limit:
+                            reader_stats["last_uid"] = None
+                # Notifichiamo solo le carte appena avvicinate, non ogni lettura della stessa carta
+                if new_uid and self.uid_callback:
+                    self.uid_callback(reader.name, uid)
+            time.sleep(self.interval)
+
+    def get_stats(self):
+        """Ritorna per ogni lettore polling e letture totali e al secondo e l'ultimo UID."""
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        with self.stats_lock:
+            return {
+                name: {
+                    "polls": reader_stats["polls"],
+                    "reads": reader_stats["reads"],
+                    "polls_per_second": round(reader_stats["polls"] / elapsed, 1) if elapsed > 0 else 0.0,
+                    "reads_per_second": round(reader_stats["reads"] / elapsed, 1) if elapsed > 0 else 0.0,
+                    "last_uid": reader_stats["last_uid"]
+                }
+                for name, reader_stats in self.stats.items()
+            }
+
+    def cleanup(self):
+        self.stop()
+        for reader in self.readers:
+            reader.cleanup()
         
 
 def test_rfid_reader():
@@ -62,5 +423,71 @@ def test_rfid_reader():
     else:
         print("Impossibile inizializzare il lettore RFID per il test.")
 
+
+def test_rfid_scanner():
+    """
+    Funzione di test dello scanner su un bus SPI simulato con tre lettori
+    (ingresso, uscita, distributore) su chip-select e reset distinti.
+    """
+    spi_bus = FakeSPIBus()
+    readers_config = [("INGRESSO", 0, 0, 22), ("USCITA", 0, 1, 18), ("DISTRIBUTORE", 1, 0, 16)]
+    detected = []
+    scanner = RFIDScanner(uid_callback=lambda name, uid: detected.append((name, uid)))
+    for name, bus, device, pin_rst in readers_config:
+        scanner.add_reader(RFIDReader(name=name, bus=bus, device=device, pin_rst=pin_rst, chip_factory=spi_bus.chip))
+    assert scanner.setup(), "Impossibile inizializzare i lettori simulati"
+    assert set(spi_bus.chips) == {(0, 0), (0, 1), (1, 0)}
+    assert spi_bus.reset_pins == {22, 18, 16}
+
+    # Un secondo lettore sullo stesso chip-select non deve inizializzarsi
+    assert not RFIDReader(name="DOPPIO", bus=0, device=1, pin_rst=12, chip_factory=spi_bus.chip).setup()
+
+    # Due lettori sul reset predefinito condiviso si inizializzano entrambi
+    shared_bus = FakeSPIBus()
+    assert RFIDReader(name="CE0", device=0, chip_factory=shared_bus.chip).setup()
+    assert RFIDReader(name="CE1", device=1, chip_factory=shared_bus.chip).setup()
+    assert shared_bus.reset_pins == {FakeSPIBus.DEFAULT_PIN_RST}
+
+    scanner.start()
+    try:
+        for card_id, (name, bus, device, _) in enumerate(readers_config[:2], start=0xC0DE1000):
+            spi_bus.present_card(bus, device, card_id)
+            time.sleep(0.3)
+            spi_bus.remove_card(bus, device)
+
+        # Con il lettore del distributore in pausa la carta non viene rilevata
+        scanner.pause("DISTRIBUTORE")
+        polls_in_pausa = scanner.get_stats()["DISTRIBUTORE"]["polls"]
+        spi_bus.present_card(1, 0, 0xC0DE1002)
+        time.sleep(0.3)
+        assert scanner.get_stats()["DISTRIBUTORE"]["polls"] == polls_in_pausa
+        assert scanner.get_stats()["INGRESSO"]["polls"] > 0
+        scanner.resume("DISTRIBUTORE")
+        time.sleep(0.3)
+    finally:
+        scanner.stop()
+
+    assert detected == [("INGRESSO", "C0DE1000"), ("USCITA", "C0DE1001"), ("DISTRIBUTORE", "C0DE1002")], detected
+    stats = scanner.get_stats()
+    for name, reader_stats in stats.items():
+        assert reader_stats["reads"] > 0 and reader_stats["polls"] >= reader_stats["reads"], (name, reader_stats)
+        assert reader_stats["reads_per_second"] > 0 and reader_stats["polls_per_second"] > 0, (name, reader_stats)
+        print(f"{name}: {reader_stats['reads_per_second']} letture/s, {reader_stats['polls_per_second']} polling/s")
+
+    # Scrittura e rilettura sul lettore del distributore, con un'autenticazione fallita
+    distributore = scanner.get_reader("DISTRIBUTORE")
+    assert distributore.write_card("CARTA 1") == "C0DE1002"
+    assert distributore.read_card_data() == ("C0DE1002", "CARTA 1")
+    spi_bus.card(1, 0)["auth_failures"] = 1
+    assert distributore.read_card_data() == ("C0DE1002", None)
+    assert distributore.read_card_data() == ("C0DE1002", "CARTA 1")
+
+    scanner.cleanup()
+    assert not spi_bus.chips and not spi_bus.reset_pins
+    print("Test dello scanner superato")
+
 if __name__ == "__main__":
-    test_rfid_reader()
\ No newline at end of file
+    if "--scanner" in sys.argv:
+        test_rfid_scanner()
+    else:
+        test_rfid_reader()
\ No newline at end of file